@@ -0,0 +1,265 @@
+"""HTTP API for estimates, alongside the Telegram bot.
+
+Turns run as background jobs on the same event loop as the bot and share
+its session store, prompt cache and render pool:
+
+    POST /api/sessions                     {"brief": "..."}  → 202 + job
+    POST /api/sessions/{id}/messages       {"text": "..."}   → 202 + job
+    GET  /api/sessions/{id}                session stage and last questions
+    GET  /api/jobs/{id}                    poll a job
+    GET  /api/jobs/{id}/events             same, as server-sent events
+    GET  /api/sessions/{id}/estimate.html  download (also .pdf, ?version=N)
+
+Every request needs ``Authorization: Bearer <API_TOKEN>``; without
+API_TOKEN configured the API answers 503.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from app.config import API_MAX_ACTIVE_JOBS, API_TOKEN, DEFAULT_RATES
+from app.diff import format_diff
+from app.html_builder import render_estimate_async, render_estimate_pdf_async
+from app.pipeline import STAGE_BRIEF, TurnResult, current_estimate, run_turn
+from app.sessions import store
+
+logger = logging.getLogger(__name__)
+
+_JOB_TTL = 3600
+
+
+def require_token(authorization: str | None = Header(default=None)) -> None:
+    """Check the shared-secret bearer token (also guards /stats in app.main)."""
+    if not API_TOKEN:
+        raise HTTPException(503, "API is disabled: API_TOKEN is not set")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(token.encode(), API_TOKEN.encode()):
+        raise HTTPException(401, "Invalid or missing token", headers={"WWW-Authenticate": "Bearer"})
+
+
+router = APIRouter(prefix="/api", dependencies=[Depends(require_token)])
+
+
+class BriefIn(BaseModel):
+    brief: str
+
+
+class MessageIn(BaseModel):
+    text: str
+
+
+@dataclass
+class Job:
+    id: str
+    session_id: str
+    status: str = "queued"  # "queued" | "running" | "done" | "error"
+    step: str = ""
+    result: dict | None = None
+    error: str = ""
+    created: float = field(default_factory=time.monotonic)
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def update(self, **fields) -> None:
+        for name, value in fields.items():
+            setattr(self, name, value)
+        # wake up every SSE listener, then re-arm for the next change
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "step": self.step,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+_jobs: dict[str, Job] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+def _session_or_404(session_id: str) -> dict:
+    session = store.get(f"api:{session_id}")
+    if session is None:
+        raise HTTPException(404, "Session not found")
+    return session
+
+
+def _turn_payload(session_id: str, turn: TurnResult, version: int) -> dict:
+    payload: dict = {"status": turn.status}
+    if turn.status == "questions":
+        payload["questions"] = turn.questions
+    elif turn.status == "error":
+        payload["error"] = turn.error
+    elif turn.status == "unchanged":
+        # nothing new to show or download — the client keeps its current version
+        payload["version"] = version
+    elif turn.result is not None:
+        payload["version"] = version
+        payload["estimate"] = turn.result.model_dump()
+        payload["changes"] = format_diff(turn.diff) if turn.diff else ""
+        payload["fixes"] = turn.fixes
+        payload["unresolved"] = [f"{v.where}: {v.detail}" for v in turn.unresolved]
+        payload["downloads"] = {
+            fmt: f"/api/sessions/{session_id}/estimate.{fmt}?version={version}"
+            for fmt in ("html", "pdf")
+        }
+    return payload
+
+
+async def _run_job(job: Job, text: str) -> None:
+    key = f"api:{job.session_id}"
+    session = store.get_or_create(key)
+    try:
+        async with store.lock(key):
+            job.update(status="running")
+            turn = await run_turn(
+                session,
+                text,
+                session.get("rates", DEFAULT_RATES),
+                tag=key,
+                progress=lambda step: job.update(step=step),
+            )
+        version = len(session.get("estimates") or [])
+        job.update(status="done", step="", result=_turn_payload(job.session_id, turn, version))
+    except Exception:
+        logger.exception("API JOB ERROR | job=%s session=%s", job.id, job.session_id)
+        job.update(status="error", step="", error="GPT request failed")
+
+
+def _check_capacity() -> None:
+    now = time.monotonic()
+    expired = [
+        j.id for j in _jobs.values()
+        if j.status in ("done", "error") and now - j.created > _JOB_TTL
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+    active = sum(j.status in ("queued", "running") for j in _jobs.values())
+    if active >= API_MAX_ACTIVE_JOBS:
+        logger.warning("API BUSY | active_jobs=%d", active)
+        raise HTTPException(429, "Too many requests in progress, try again later")
+
+
+def _start_job(session_id: str, text: str) -> dict:
+    job = Job(id=uuid.uuid4().hex, session_id=session_id)
+    _jobs[job.id] = job
+    task = asyncio.create_task(_run_job(job, text))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job.to_dict() | {
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+    }
+
+
+# ── sessions ─────────────────────────────────────────────
+
+@router.post("/sessions", status_code=202)
+async def create_session(body: BriefIn):
+    _check_capacity()
+    key, _ = store.create("api")
+    session_id = key.removeprefix("api:")
+    logger.info("API SESSION | session=%s | brief_len=%d", session_id, len(body.brief))
+    return _start_job(session_id, body.brief)
+
+
+@router.post("/sessions/{session_id}/messages", status_code=202)
+async def post_message(session_id: str, body: MessageIn):
+    _session_or_404(session_id)
+    if any(
+        j.session_id == session_id and j.status in ("queued", "running")
+        for j in _jobs.values()
+    ):
+        raise HTTPException(409, "A previous message is still being processed")
+    _check_capacity()
+    return _start_job(session_id, body.text)
+
+
+@router.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    session = _session_or_404(session_id)
+    latest = current_estimate(session)
+    return {
+        "session_id": session_id,
+        "stage": session.get("stage", STAGE_BRIEF),
+        "questions": session.get("questions", []),
+        "versions": len(session.get("estimates") or []),
+        "project_name": latest.project_name if latest else None,
+    }
+
+
+@router.get("/sessions/{session_id}/estimate.{fmt}")
+async def download_estimate(session_id: str, fmt: str, version: int | None = None):
+    session = _session_or_404(session_id)
+    render = {"html": render_estimate_async, "pdf": render_estimate_pdf_async}.get(fmt)
+    if render is None:
+        raise HTTPException(404, "Unknown format")
+    result = current_estimate(session, version)
+    if result is None:
+        raise HTTPException(404, "Estimate not found")
+
+    try:
+        path = await render(result, session.get("rates", DEFAULT_RATES))
+    except Exception:
+        logger.exception("API RENDER ERROR | session=%s format=%s", session_id, fmt)
+        raise HTTPException(500, "Render failed")
+    return FileResponse(
+        path,
+        media_type="text/html" if fmt == "html" else "application/pdf",
+        filename=f"{result.project_name}.{fmt}",
+        background=BackgroundTask(os.unlink, path),
+    )
+
+
+# ── jobs ─────────────────────────────────────────────────
+
+def _job_or_404(job_id: str) -> Job:
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return _job_or_404(job_id).to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = _job_or_404(job_id)
+
+    async def stream():
+        sent = None
+        while True:
+            changed = job.changed
+            data = job.to_dict()
+            if data != sent:
+                yield f"event: {data['status']}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                sent = data
+            if job.status in ("done", "error"):
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
@@ -14,9 +14,15 @@ from telegram.ext import (
 )
 
 from app.config import TELEGRAM_BOT_TOKEN, DEFAULT_RATES, VERSION
-from app.gpt_client import ask_gpt
-from app.html_builder import render_estimate, render_estimate_pdf
-from app.prompt import build_system_prompt
+from app.diff import format_diff
+from app.pipeline import (
+    STAGE_DIALOG,
+    STAGE_REFINE,
+    render_files,
+    reset_session,
+    run_turn,
+)
+from app.sessions import store
 
 logger = logging.getLogger(__name__)
 
@@ -31,8 +37,16 @@ async def _keep_typing(chat):
         await asyncio.sleep(4)
 
 
-def _get_rates(context: ContextTypes.DEFAULT_TYPE) -> dict[str, int]:
-    return context.user_data.get("rates", DEFAULT_RATES)
+def _session_key(update: Update) -> str:
+    return f"tg:{update.effective_user.id}"
+
+
+def _session(update: Update) -> dict:
+    return store.get_or_create(_session_key(update))
+
+
+def _get_rates(session: dict) -> dict[str, int]:
+    return session.get("rates", DEFAULT_RATES)
 
 
 def _format_questions(questions: list[str]) -> str:
@@ -68,7 +82,7 @@ HELP_TEXT = (
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info("CMD /start | %s", _user_tag(update))
-    context.user_data.clear()
+    _session(update).clear()
     await update.message.reply_text(
         "Привет! Я SmartSmeta — бот для генерации IT-смет.\n\n"
         + HELP_TEXT
@@ -84,7 +98,7 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def new(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info("CMD /new | %s", _user_tag(update))
-    context.user_data.pop("response_id", None)
+    reset_session(_session(update))
     await update.message.reply_text(
         "Начинаем заново. Отправь бриф нового проекта."
     )
@@ -93,7 +107,7 @@ async def new(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     logger.info("CMD /cancel | %s", _user_tag(update))
-    context.user_data.pop("response_id", None)
+    reset_session(_session(update))
     await update.message.reply_text(
         "Диалог отменён. Отправь /new чтобы начать заново."
     )
@@ -102,7 +116,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def rates_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("CMD /rates | %s", _user_tag(update))
-    rates = _get_rates(context)
+    rates = _get_rates(_session(update))
     lines = [f"  {role}: {rate} руб/ч" for role, rate in rates.items()]
     await update.message.reply_text(
         "Текущие ставки:\n" + "\n".join(lines)
@@ -111,167 +125,139 @@ async def rates_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 # ── conversation handlers ────────────────────────────────
 
-async def handle_brief(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """User sent the initial brief."""
+_STATES = {STAGE_DIALOG: DIALOG, STAGE_REFINE: REFINE}
+
+
+async def _handle_turn(update: Update, kind: str, on_error: int) -> int:
+    """Run one pipeline turn for the user's message and reply with the outcome."""
+    tag = _user_tag(update)
     user_text = update.message.text
-    logger.info("BRIEF | %s | len=%d | text=%s", _user_tag(update), len(user_text), user_text[:300])
-    rates = _get_rates(context)
-    system_prompt = build_system_prompt(rates)
+    key = _session_key(update)
+    session = _session(update)
+    rates = _get_rates(session)
+    logger.info(
+        "%s | %s | prev_id=%s | len=%d | text=%s",
+        kind, tag, session.get("response_id"), len(user_text), user_text[:300],
+    )
 
     typing_task = asyncio.create_task(_keep_typing(update.message.chat))
     try:
-        gpt_resp, response_id = await ask_gpt(
-            system_prompt=system_prompt,
-            user_message=user_text,
-            previous_response_id=None,
-        )
+        async with store.lock(key):
+            turn = await run_turn(session, user_text, rates, tag=tag)
     except Exception:
-        logger.exception("GPT ERROR on brief | %s", _user_tag(update))
+        logger.exception("GPT ERROR on %s | %s", kind.lower(), tag)
         await update.message.reply_text(
             "Произошла ошибка при обращении к GPT. Попробуйте ещё раз."
         )
-        return WAITING_FOR_BRIEF
+        return on_error
     finally:
         typing_task.cancel()
 
-    context.user_data["response_id"] = response_id
-    logger.info("BRIEF OK | %s | response_id=%s", _user_tag(update), response_id)
+    state = _STATES.get(session.get("stage"), on_error)
 
-    return await _process_gpt_response(update, context, gpt_resp, rates)
-
-
-async def handle_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """User replied to follow-up questions."""
-    user_text = update.message.text
-    prev_id = context.user_data.get("response_id")
-    logger.info("DIALOG | %s | prev_id=%s | text=%s", _user_tag(update), prev_id, user_text[:300])
-    rates = _get_rates(context)
-    system_prompt = build_system_prompt(rates)
+    if turn.status == "questions":
+        text = "У меня есть уточняющие вопросы:\n\n" + _format_questions(turn.questions)
+        await update.message.reply_text(text)
+        return DIALOG
 
-    typing_task = asyncio.create_task(_keep_typing(update.message.chat))
-    try:
-        gpt_resp, response_id = await ask_gpt(
-            system_prompt=system_prompt,
-            user_message=user_text,
-            previous_response_id=prev_id,
-        )
-    except Exception:
-        logger.exception("GPT ERROR on dialog | %s | prev_id=%s", _user_tag(update), prev_id)
+    if turn.status == "unchanged":
         await update.message.reply_text(
-            "Произошла ошибка при обращении к GPT. Попробуйте ещё раз."
+            "Смета не изменилась. Уточните, что нужно поправить."
         )
-        return DIALOG
-    finally:
-        typing_task.cancel()
+        return REFINE
 
-    context.user_data["response_id"] = response_id
-    logger.info("DIALOG OK | %s | response_id=%s", _user_tag(update), response_id)
+    if turn.status == "error":
+        await update.message.reply_text(turn.error + " Попробуйте ещё раз или /new.")
+        return state
+
+    if turn.diff is not None:
+        await update.message.reply_text(format_diff(turn.diff))
+    if turn.fixes:
+        lines = turn.fixes[:10]
+        if len(turn.fixes) > 10:
+            lines.append(f"…и ещё {len(turn.fixes) - 10}")
+        await update.message.reply_text("Автоматически исправлено:\n" + "\n".join(lines))
+    if turn.unresolved:
+        await update.message.reply_text(
+            "Не удалось исправить (стоимость этих задач не посчитана):\n"
+            + "\n".join(f"{v.where}: {v.detail}" for v in turn.unresolved[:10])
+        )
 
-    return await _process_gpt_response(update, context, gpt_resp, rates)
+    await _send_files(update, turn.result, rates)
+    return REFINE
 
 
-async def _process_gpt_response(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    gpt_resp,
-    rates: dict[str, int],
-) -> int:
+async def _send_files(update: Update, result, rates: dict[str, int]) -> None:
     tag = _user_tag(update)
+    await update.message.reply_text("Смета готова! Генерирую файлы...")
 
-    if gpt_resp.status == "need_info":
-        logger.info("GPT→QUESTIONS | %s | count=%d", tag, len(gpt_resp.questions))
-        text = "У меня есть уточняющие вопросы:\n\n" + _format_questions(gpt_resp.questions)
-        await update.message.reply_text(text)
-        return DIALOG
-
-    if gpt_resp.status == "ready" and gpt_resp.result:
-        logger.info(
-            "GPT→ESTIMATE | %s | project=%s variants=%d",
-            tag, gpt_resp.result.project_name, len(gpt_resp.result.variants),
-        )
-        await update.message.reply_text("Смета готова! Генерирую файлы...")
-
-        html_path = pdf_path = None
-        try:
-            html_path = render_estimate(gpt_resp.result, rates)
-        except Exception:
-            logger.exception("HTML RENDER ERROR | %s", tag)
-
-        try:
-            pdf_path = render_estimate_pdf(gpt_resp.result, rates)
-        except Exception:
-            logger.exception("PDF RENDER ERROR | %s", tag)
-
-        if not html_path and not pdf_path:
-            await update.message.reply_text(
-                "Ошибка при генерации файлов. Попробуйте /new."
-            )
-            return REFINE
-
-        project_name = gpt_resp.result.project_name
-        try:
-            if html_path:
-                with open(html_path, "rb") as f:
-                    await update.message.reply_document(
-                        document=f,
-                        filename=f"{project_name}.html",
-                    )
-            if pdf_path:
-                with open(pdf_path, "rb") as f:
-                    await update.message.reply_document(
-                        document=f,
-                        filename=f"{project_name}.pdf",
-                    )
-            logger.info("FILES SENT | %s | project=%s html=%s pdf=%s",
-                        tag, project_name, bool(html_path), bool(pdf_path))
-        finally:
-            if html_path:
-                os.unlink(html_path)
-            if pdf_path:
-                os.unlink(pdf_path)
-
+    html_path, pdf_path = await render_files(result, rates, tag=tag)
+    if not html_path and not pdf_path:
         await update.message.reply_text(
-            "Готово! HTML — для просмотра в браузере, PDF — для печати.\n\n"
-            "Можете написать правки — я пересгенерирую смету.\n"
-            "/new — начать новую смету с чистого листа"
+            "Ошибка при генерации файлов. Попробуйте /new."
         )
-        return REFINE
+        return
+
+    project_name = result.project_name
+    try:
+        if html_path:
+            with open(html_path, "rb") as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=f"{project_name}.html",
+                )
+        if pdf_path:
+            with open(pdf_path, "rb") as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=f"{project_name}.pdf",
+                )
+        logger.info("FILES SENT | %s | project=%s html=%s pdf=%s",
+                    tag, project_name, bool(html_path), bool(pdf_path))
+    finally:
+        if html_path:
+            os.unlink(html_path)
+        if pdf_path:
+            os.unlink(pdf_path)
 
-    logger.warning("GPT→UNEXPECTED | %s | status=%s", tag, gpt_resp.status)
     await update.message.reply_text(
-        "Неожиданный ответ от GPT. Попробуйте ещё раз или /new."
+        "Готово! HTML — для просмотра в браузере, PDF — для печати.\n\n"
+        "Можете написать правки — я пересгенерирую смету.\n"
+        "/new — начать новую смету с чистого листа"
     )
-    return DIALOG
 
 
-async def handle_refine(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """User wants to refine the delivered estimate."""
-    user_text = update.message.text
-    prev_id = context.user_data.get("response_id")
-    logger.info("REFINE | %s | prev_id=%s | text=%s", _user_tag(update), prev_id, user_text[:300])
-    rates = _get_rates(context)
-    system_prompt = build_system_prompt(rates)
+async def handle_brief(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """User sent the initial brief."""
+    reset_session(_session(update))
+    return await _handle_turn(update, "BRIEF", WAITING_FOR_BRIEF)
 
-    typing_task = asyncio.create_task(_keep_typing(update.message.chat))
-    try:
-        gpt_resp, response_id = await ask_gpt(
-            system_prompt=system_prompt,
-            user_message=user_text,
-            previous_response_id=prev_id,
-        )
-    except Exception:
-        logger.exception("GPT ERROR on refine | %s | prev_id=%s", _user_tag(update), prev_id)
-        await update.message.reply_text(
-            "Произошла ошибка при обращении к GPT. Попробуйте ещё раз."
-        )
-        return REFINE
-    finally:
-        typing_task.cancel()
 
-    context.user_data["response_id"] = response_id
-    logger.info("REFINE OK | %s | response_id=%s", _user_tag(update), response_id)
+async def _session_expired(update: Update) -> bool:
+    # the store drops idle sessions after SESSION_TTL, but the conversation
+    # state doesn't expire — don't let a late reply start a new estimate
+    if _session(update).get("stage"):
+        return False
+    logger.info("SESSION EXPIRED | %s", _user_tag(update))
+    await update.message.reply_text(
+        "Сессия истекла — предыдущая смета больше недоступна. "
+        "Отправь /new и бриф, чтобы начать заново."
+    )
+    return True
 
-    return await _process_gpt_response(update, context, gpt_resp, rates)
+
+async def handle_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """User replied to follow-up questions."""
+    if await _session_expired(update):
+        return ConversationHandler.END
+    return await _handle_turn(update, "DIALOG", DIALOG)
+
+
+async def handle_refine(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """User wants to refine the delivered estimate."""
+    if await _session_expired(update):
+        return ConversationHandler.END
+    return await _handle_turn(update, "REFINE", REFINE)
 
 
 # ── bot factory ──────────────────────────────────────────
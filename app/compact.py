@@ -0,0 +1,176 @@
+"""Compact in-memory estimate representation for session history.
+
+A pydantic ``EstimateResult`` costs one model instance plus a ``__dict__``
+per task line. Here each variant keeps its tasks as a column table:
+titles in a tuple, phase/role indexes and hours in typed arrays, with
+role and phase names interned. Conversion to and from the pydantic
+models is lossless; use ``to_model()`` at the API/render boundary.
+
+Run ``python -m app.compact [tasks]`` for a bytes-per-task-line benchmark.
+"""
+
+from __future__ import annotations
+
+import sys
+from array import array
+
+from app.models import EstimateResult, Phase, TaskLine, Timeline, Variant
+
+
+class CompactVariant:
+    __slots__ = (
+        "name", "description", "timeline",
+        "phase_names", "task_names", "task_phase", "task_role", "hours",
+    )
+
+    def __init__(self, variant: Variant, role_index: dict[str, int]):
+        self.name = variant.name
+        self.description = variant.description
+        t = variant.timeline
+        self.timeline = (t.total_weeks_min, t.total_weeks_max, t.note) if t else None
+
+        self.phase_names = tuple(sys.intern(p.name) for p in variant.phases)
+        names: list[str] = []
+        self.task_phase = array("H")
+        self.task_role = array("H")
+        self.hours = array("d")  # hours_min, hours_base, hours_max per task
+        for p_idx, phase in enumerate(variant.phases):
+            for t in phase.tasks:
+                names.append(t.task)
+                self.task_phase.append(p_idx)
+                role = sys.intern(t.role)
+                self.task_role.append(role_index.setdefault(role, len(role_index)))
+                self.hours.extend((t.hours_min, t.hours_base, t.hours_max))
+        self.task_names = tuple(names)
+
+    def to_model(self, roles: tuple[str, ...]) -> Variant:
+        phases = [Phase(name=name, tasks=[]) for name in self.phase_names]
+        h = self.hours
+        for i, task in enumerate(self.task_names):
+            phases[self.task_phase[i]].tasks.append(TaskLine(
+                task=task,
+                role=roles[self.task_role[i]],
+                hours_min=h[3 * i],
+                hours_base=h[3 * i + 1],
+                hours_max=h[3 * i + 2],
+            ))
+        timeline = None
+        if self.timeline:
+            wmin, wmax, note = self.timeline
+            timeline = Timeline(total_weeks_min=wmin, total_weeks_max=wmax, note=note)
+        return Variant(
+            name=self.name,
+            description=self.description,
+            phases=phases,
+            timeline=timeline,
+        )
+
+
+class CompactEstimate:
+    __slots__ = (
+        "project_name", "client", "project_type", "scope_summary",
+        "assumptions", "risks", "out_of_scope", "roles", "variants",
+    )
+
+    def __init__(self, result: EstimateResult):
+        self.project_name = result.project_name
+        self.client = result.client
+        self.project_type = result.project_type
+        self.scope_summary = result.scope_summary
+        self.assumptions = tuple(result.assumptions)
+        self.risks = tuple(result.risks)
+        self.out_of_scope = tuple(result.out_of_scope)
+
+        role_index: dict[str, int] = {}
+        self.variants = tuple(CompactVariant(v, role_index) for v in result.variants)
+        self.roles = tuple(role_index)
+
+    @classmethod
+    def from_model(cls, result: EstimateResult) -> CompactEstimate:
+        return cls(result)
+
+    def to_model(self) -> EstimateResult:
+        return EstimateResult(
+            project_name=self.project_name,
+            client=self.client,
+            project_type=self.project_type,
+            scope_summary=self.scope_summary,
+            assumptions=list(self.assumptions),
+            risks=list(self.risks),
+            out_of_scope=list(self.out_of_scope),
+            variants=[v.to_model(self.roles) for v in self.variants],
+        )
+
+    @property
+    def task_count(self) -> int:
+        return sum(len(v.task_names) for v in self.variants)
+
+
+# ── memory benchmark ─────────────────────────────────────
+
+def _sample_payload(n_tasks: int) -> dict:
+    """Synthetic estimate shaped like a real one: 3 variants × 6 phases."""
+    roles = ["PM", "Аналитик", "Дизайнер", "Frontend", "Backend", "QA", "DevOps"]
+    phases = ["Аналитика", "Дизайн", "Frontend", "Backend", "Тестирование", "Деплой"]
+    per_variant = max(1, n_tasks // 3)
+    variants = []
+    for v_name in ("MVP", "Standard", "Full"):
+        v_phases = [{"name": p, "tasks": []} for p in phases]
+        for i in range(per_variant):
+            v_phases[i % len(phases)]["tasks"].append({
+                "task": f"Задача {i} варианта {v_name}",
+                "role": roles[i % len(roles)],
+                "hours_min": 4.0 + i % 8,
+                "hours_base": 8.0 + i % 12,
+                "hours_max": 12.0 + i % 16,
+            })
+        variants.append({"name": v_name, "phases": v_phases})
+    return {"project_name": "Benchmark", "scope_summary": "—", "variants": variants}
+
+
+def _measure(build) -> int:
+    import tracemalloc
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    obj = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    del obj
+    return size
+
+
+def benchmark(n_tasks: int = 3000) -> dict[str, float]:
+    """Retained bytes per task line for each representation.
+
+    Every build parses the same JSON, so strings are fresh per task just
+    like in a real GPT response.
+    """
+    import json
+
+    from app.config import DEFAULT_RATES
+    from app.html_builder import _enrich
+
+    raw = json.dumps(_sample_payload(n_tasks), ensure_ascii=False)
+    source = EstimateResult.model_validate_json(raw)
+    count = CompactEstimate(source).task_count
+
+    def pydantic_enriched():
+        result = EstimateResult.model_validate_json(raw)
+        _enrich(result, DEFAULT_RATES)
+        return result
+
+    return {
+        "pydantic": _measure(lambda: EstimateResult.model_validate_json(raw)) / count,
+        "pydantic+_enrich": _measure(pydantic_enriched) / count,
+        "compact": _measure(
+            lambda: CompactEstimate(EstimateResult.model_validate_json(raw))
+        ) / count,
+    }
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    for name, per_task in benchmark(n).items():
+        print(f"{name:<18} {per_task:8.1f} bytes/task")
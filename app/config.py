@@ -8,7 +8,41 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 VERSION = "0.3.0"
 
-GPT_MODEL = "gpt-5.2-pro"
+GPT_MODEL = os.getenv("GPT_MODEL", "gpt-5.2-pro")
+GPT_MODEL_MID = os.getenv("GPT_MODEL_MID", "gpt-5.2")
+GPT_MODEL_LIGHT = os.getenv("GPT_MODEL_LIGHT", "gpt-5-mini")
+
+# conversation stage → model
+GPT_ROUTES = {
+    "questions": GPT_MODEL_LIGHT,
+    "refine": GPT_MODEL_MID,
+    "estimate": GPT_MODEL,
+}
+
+# generate final-estimate variants as concurrent per-variant requests
+PARALLEL_VARIANTS = os.getenv("PARALLEL_VARIANTS", "0") == "1"
+PARALLEL_VARIANT_ATTEMPTS = 3
+
+# append every GPT request/response to this JSONL corpus (see app/replay.py)
+GPT_RECORD_PATH = os.getenv("GPT_RECORD_PATH")
+
+# idle estimate sessions (bot and API) are dropped after this many seconds
+SESSION_TTL = int(os.getenv("SESSION_TTL", 7 * 24 * 3600))
+
+# threads for HTML/PDF rendering, shared by the bot and the API
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", 4))
+
+# shared secret for /api/* and /stats (Authorization: Bearer <token>); unset = disabled
+API_TOKEN = os.getenv("API_TOKEN")
+# queued + running API jobs; new messages get 429 above this
+API_MAX_ACTIVE_JOBS = int(os.getenv("API_MAX_ACTIVE_JOBS", 20))
+
+# USD per 1M tokens: (input, output)
+GPT_PRICES = {
+    "gpt-5.2-pro": (21.0, 168.0),
+    "gpt-5.2": (1.75, 14.0),
+    "gpt-5-mini": (0.25, 2.0),
+}
 
 DEFAULT_RATES = {
     "PM": 4000, "Аналитик": 4500, "Дизайнер": 4000,
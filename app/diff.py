@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import copy
+from dataclasses import dataclass, field
+
+from app.models import EstimateResult, Phase, TaskLine, Variant
+
+_SUMMARY_MAX_LINES = 20
+
+
+@dataclass
+class TaskChange:
+    kind: str  # "added" | "removed" | "changed"
+    variant: str
+    phase: str
+    task: str
+    old: TaskLine | None
+    new: TaskLine | None
+    hours_delta: float
+    cost_delta: float
+
+
+@dataclass
+class VariantDelta:
+    name: str
+    hours_before: float
+    hours_after: float
+    cost_before: float
+    cost_after: float
+
+
+@dataclass
+class EstimateDiff:
+    fields_changed: list[str] = field(default_factory=list)
+    variants_added: list[str] = field(default_factory=list)
+    variants_removed: list[str] = field(default_factory=list)
+    phases_added: list[tuple[str, str]] = field(default_factory=list)
+    phases_removed: list[tuple[str, str]] = field(default_factory=list)
+    # (variant, "description" | "timeline") for variants present in both revisions
+    variant_fields_changed: list[tuple[str, str]] = field(default_factory=list)
+    tasks: list[TaskChange] = field(default_factory=list)
+    variant_totals: list[VariantDelta] = field(default_factory=list)
+
+    @property
+    def empty(self) -> bool:
+        return not (
+            self.fields_changed or self.variants_added or self.variants_removed
+            or self.phases_added or self.phases_removed
+            or self.variant_fields_changed or self.tasks
+        )
+
+
+# ── structural diff ──────────────────────────────────────
+
+def _task_cost(t: TaskLine, rates: dict[str, int]) -> float:
+    return t.hours_base * rates.get(t.role, 0)
+
+
+def _variant_totals(variant: Variant | None, rates: dict[str, int]) -> tuple[float, float]:
+    if variant is None:
+        return 0.0, 0.0
+    hours = cost = 0.0
+    for phase in variant.phases:
+        for t in phase.tasks:
+            hours += t.hours_base
+            cost += _task_cost(t, rates)
+    return hours, cost
+
+
+def _by_name(items: list) -> dict:
+    """Index items by .name (or .task); later duplicates get a #N suffix."""
+    out: dict = {}
+    for item in items:
+        key = getattr(item, "name", None) or getattr(item, "task", "")
+        base, n = key, 2
+        while key in out:
+            key = f"{base} #{n}"
+            n += 1
+        out[key] = item
+    return out
+
+
+def _diff_phase(
+    diff: EstimateDiff,
+    variant: str,
+    phase: str,
+    old: Phase | None,
+    new: Phase | None,
+    rates: dict[str, int],
+) -> None:
+    old_tasks = _by_name(old.tasks if old else [])
+    new_tasks = _by_name(new.tasks if new else [])
+
+    for key, t in new_tasks.items():
+        prev = old_tasks.get(key)
+        if prev is None:
+            diff.tasks.append(TaskChange(
+                "added", variant, phase, key, None, t,
+                t.hours_base, _task_cost(t, rates),
+            ))
+        elif prev != t:
+            diff.tasks.append(TaskChange(
+                "changed", variant, phase, key, prev, t,
+                t.hours_base - prev.hours_base,
+                _task_cost(t, rates) - _task_cost(prev, rates),
+            ))
+
+    for key, t in old_tasks.items():
+        if key not in new_tasks:
+            diff.tasks.append(TaskChange(
+                "removed", variant, phase, key, t, None,
+                -t.hours_base, -_task_cost(t, rates),
+            ))
+
+
+def diff_estimates(
+    old: EstimateResult,
+    new: EstimateResult,
+    rates: dict[str, int],
+) -> EstimateDiff:
+    """Compare two estimate revisions variant → phase → task.
+
+    Variants and phases are matched by name, tasks by their title within
+    a phase. Hour deltas use hours_base; cost deltas use the given rates.
+    """
+    diff = EstimateDiff()
+
+    for name in ("project_name", "client", "project_type", "scope_summary",
+                 "assumptions", "risks", "out_of_scope"):
+        if getattr(old, name) != getattr(new, name):
+            diff.fields_changed.append(name)
+
+    old_variants = _by_name(old.variants)
+    new_variants = _by_name(new.variants)
+
+    for v_name in dict.fromkeys([*old_variants, *new_variants]):
+        old_v = old_variants.get(v_name)
+        new_v = new_variants.get(v_name)
+        if old_v is None:
+            diff.variants_added.append(v_name)
+        elif new_v is None:
+            diff.variants_removed.append(v_name)
+        else:
+            for name in ("description", "timeline"):
+                if getattr(old_v, name) != getattr(new_v, name):
+                    diff.variant_fields_changed.append((v_name, name))
+
+        old_phases = _by_name(old_v.phases) if old_v else {}
+        new_phases = _by_name(new_v.phases) if new_v else {}
+        for p_name in dict.fromkeys([*old_phases, *new_phases]):
+            old_p = old_phases.get(p_name)
+            new_p = new_phases.get(p_name)
+            if old_v and new_v:
+                if old_p is None:
+                    diff.phases_added.append((v_name, p_name))
+                elif new_p is None:
+                    diff.phases_removed.append((v_name, p_name))
+            _diff_phase(diff, v_name, p_name, old_p, new_p, rates)
+
+        h_before, c_before = _variant_totals(old_v, rates)
+        h_after, c_after = _variant_totals(new_v, rates)
+        diff.variant_totals.append(VariantDelta(v_name, h_before, h_after, c_before, c_after))
+
+    return diff
+
+
+# ── summary message ──────────────────────────────────────
+
+_FIELD_LABELS = {
+    "project_name": "название проекта",
+    "client": "заказчик",
+    "project_type": "тип проекта",
+    "scope_summary": "описание scope",
+    "assumptions": "допущения",
+    "risks": "риски",
+    "out_of_scope": "что не входит",
+}
+
+_VARIANT_FIELD_LABELS = {
+    "description": "описание",
+    "timeline": "сроки",
+}
+
+
+def _num(value: float) -> str:
+    return "{:,.0f}".format(value).replace(",", " ")
+
+
+def _signed(value: float) -> str:
+    return ("+" if value >= 0 else "−") + _num(abs(value))
+
+
+def _task_line(c: TaskChange) -> str:
+    where = f"{c.variant} / {c.phase}"
+    if c.kind == "added":
+        return (f"+ {where}: «{c.task}» ({c.new.role}, {_num(c.new.hours_base)} ч, "
+                f"{_signed(c.cost_delta)} руб.)")
+    if c.kind == "removed":
+        return (f"− {where}: «{c.task}» ({c.old.role}, {_num(c.old.hours_base)} ч, "
+                f"{_signed(c.cost_delta)} руб.)")
+    parts = []
+    if c.old.role != c.new.role:
+        parts.append(f"{c.old.role} → {c.new.role}")
+    if (c.old.hours_min, c.old.hours_base, c.old.hours_max) != (
+        c.new.hours_min, c.new.hours_base, c.new.hours_max
+    ):
+        parts.append(f"{_num(c.old.hours_base)} → {_num(c.new.hours_base)} ч")
+    detail = ", ".join(parts) or "уточнена"
+    return f"~ {where}: «{c.task}» ({detail}, {_signed(c.cost_delta)} руб.)"
+
+
+def format_diff(diff: EstimateDiff) -> str:
+    """Compact human-readable change summary for the chat."""
+    if diff.empty:
+        return "Смета не изменилась."
+
+    lines: list[str] = []
+    if diff.fields_changed:
+        lines.append("Обновлено: " + ", ".join(_FIELD_LABELS[f] for f in diff.fields_changed))
+    for name in diff.variants_added:
+        lines.append(f"+ вариант «{name}»")
+    for name in diff.variants_removed:
+        lines.append(f"− вариант «{name}»")
+    for v_name, p_name in diff.phases_added:
+        lines.append(f"+ {v_name}: этап «{p_name}»")
+    for v_name, p_name in diff.phases_removed:
+        lines.append(f"− {v_name}: этап «{p_name}»")
+    for v_name, name in diff.variant_fields_changed:
+        lines.append(f"~ {v_name}: {_VARIANT_FIELD_LABELS[name]}")
+
+    # tasks of whole added/removed variants and phases are already covered above
+    skip_v = set(diff.variants_added) | set(diff.variants_removed)
+    skip_p = set(diff.phases_added) | set(diff.phases_removed)
+    lines.extend(
+        _task_line(c) for c in diff.tasks
+        if c.variant not in skip_v and (c.variant, c.phase) not in skip_p
+    )
+
+    if len(lines) > _SUMMARY_MAX_LINES:
+        rest = len(lines) - _SUMMARY_MAX_LINES
+        lines = lines[:_SUMMARY_MAX_LINES] + [f"…и ещё {rest}"]
+
+    totals = []
+    for v in diff.variant_totals:
+        if v.hours_before == v.hours_after and v.cost_before == v.cost_after:
+            continue
+        totals.append(
+            f"{v.name}: {_num(v.hours_before)} → {_num(v.hours_after)} ч "
+            f"({_signed(v.cost_after - v.cost_before)} руб.)"
+        )
+
+    text = "Что изменилось:\n" + "\n".join(lines)
+    if totals:
+        text += "\n\nИтого (base):\n" + "\n".join(totals)
+    return text
+
+
+# ── JSON-patch responses ─────────────────────────────────
+
+def _pointer(path: str) -> list[str]:
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise ValueError(f"Invalid JSON pointer: {path!r}")
+    return [p.replace("~1", "/").replace("~0", "~") for p in path[1:].split("/")]
+
+
+def _index(token: str, size: int) -> int:
+    """Array index per RFC 6901: a non-negative decimal, less than *size*."""
+    if not (token.isascii() and token.isdigit()):
+        raise IndexError(token)
+    idx = int(token)
+    if idx >= size:
+        raise IndexError(idx)
+    return idx
+
+
+def _walk(doc, tokens: list[str]):
+    for token in tokens:
+        if isinstance(doc, list):
+            doc = doc[_index(token, len(doc))]
+        else:
+            doc = doc[token]
+    return doc
+
+
+def apply_patch(result: EstimateResult, ops: list[dict]) -> EstimateResult:
+    """Apply JSON-patch ops (RFC 6902: add / remove / replace) to an estimate.
+
+    Raises ValueError if an op is malformed or the patched document no
+    longer validates as an EstimateResult.
+    """
+    doc = copy.deepcopy(result.model_dump())
+
+    for i, op in enumerate(ops):
+        try:
+            kind = op["op"]
+            tokens = _pointer(op["path"])
+            if not tokens:
+                raise ValueError("root path is not allowed")
+            parent = _walk(doc, tokens[:-1])
+            key = tokens[-1]
+
+            if isinstance(parent, list):
+                if kind == "add":
+                    idx = len(parent) if key == "-" else _index(key, len(parent) + 1)
+                    parent.insert(idx, op["value"])
+                elif kind == "remove":
+                    del parent[_index(key, len(parent))]
+                elif kind == "replace":
+                    parent[_index(key, len(parent))] = op["value"]
+                else:
+                    raise ValueError(f"unsupported op {kind!r}")
+            else:
+                if kind in ("add", "replace"):
+                    if kind == "replace" and key not in parent:
+                        raise KeyError(key)
+                    parent[key] = op["value"]
+                elif kind == "remove":
+                    del parent[key]
+                else:
+                    raise ValueError(f"unsupported op {kind!r}")
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            raise ValueError(f"Could not apply patch op #{i} {op!r}: {e!r}") from e
+
+    try:
+        return EstimateResult.model_validate(doc)
+    except Exception as e:
+        raise ValueError(f"Patched estimate is invalid: {e}") from e
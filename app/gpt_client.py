@@ -1,16 +1,61 @@
+import asyncio
+import hashlib
 import json
 import re
 import logging
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
 
-from openai import AsyncOpenAI
+from openai import APIError, AsyncOpenAI
+from pydantic import ValidationError
 
-from app.config import OPENAI_API_KEY, GPT_MODEL
-from app.models import GptResponse
+from app.config import (
+    OPENAI_API_KEY,
+    GPT_RECORD_PATH,
+    GPT_PRICES,
+    GPT_ROUTES,
+    PARALLEL_VARIANTS,
+    PARALLEL_VARIANT_ATTEMPTS,
+)
+from app.models import EstimateResult, GptResponse, Variant
+from app.prompt import READY_SIGNAL_ADDENDUM
 
 logger = logging.getLogger(__name__)
 
 _client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
+ROUTE_QUESTIONS = "questions"
+ROUTE_REFINE = "refine"
+ROUTE_ESTIMATE = "estimate"
+
+
+@dataclass
+class RouteStats:
+    calls: int = 0
+    failures: int = 0  # unparsable / invalid output
+    api_errors: int = 0  # transport and API errors
+    escalations: int = 0
+    latency_total: float = 0.0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost_usd: float = 0.0
+
+
+_stats: dict[str, RouteStats] = {}
+
+
+def get_route_stats() -> dict[str, dict]:
+    """Per-route counters plus average latency, for /stats."""
+    out = {}
+    for route, st in _stats.items():
+        out[route] = asdict(st) | {
+            "model": GPT_ROUTES[route],
+            "latency_avg": st.latency_total / st.calls if st.calls else 0.0,
+        }
+    return out
+
 
 def _parse_json(text: str) -> dict:
     """3-level JSON parsing: direct → markdown fence → brace search."""
@@ -46,18 +91,18 @@ def _parse_json(text: str) -> dict:
     raise ValueError(f"Could not parse JSON from GPT response: {text[:500]}")
 
 
-async def ask_gpt(
+async def _request(
+    route: str,
     system_prompt: str,
     user_message: str,
-    previous_response_id: str | None = None,
-) -> tuple[GptResponse, str]:
-    """Send a message to GPT and return parsed response + response_id.
+    previous_response_id: str | None,
+) -> tuple[str, str]:
+    """Raw Responses API call on the route's model. Returns (text, response_id)."""
+    model = GPT_ROUTES[route]
+    stats = _stats.setdefault(route, RouteStats())
 
-    Returns:
-        (GptResponse, response_id) tuple
-    """
     kwargs: dict = {
-        "model": GPT_MODEL,
+        "model": model,
         "instructions": system_prompt,
         "input": [{"role": "user", "content": user_message}],
     }
@@ -66,25 +111,251 @@ async def ask_gpt(
         kwargs["previous_response_id"] = previous_response_id
 
     logger.info(
-        "GPT REQUEST | model=%s prev_id=%s | user_message=%s",
-        GPT_MODEL,
+        "GPT REQUEST | route=%s model=%s prev_id=%s | user_message=%s",
+        route,
+        model,
         previous_response_id or "None",
         user_message[:200],
     )
 
-    response = await _client.responses.create(**kwargs)
+    started = time.perf_counter()
+    try:
+        response = await _client.responses.create(**kwargs)
+    except Exception:
+        stats.api_errors += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.calls += 1
+        stats.latency_total += elapsed
+    usage = getattr(response, "usage", None)
+    if usage:
+        stats.input_tokens += usage.input_tokens
+        stats.output_tokens += usage.output_tokens
+        price_in, price_out = GPT_PRICES.get(model, (0.0, 0.0))
+        stats.cost_usd += (usage.input_tokens * price_in + usage.output_tokens * price_out) / 1e6
 
     raw_text = response.output_text
     logger.info(
-        "GPT RESPONSE | id=%s | length=%d | text=%s",
+        "GPT RESPONSE | id=%s | route=%s | %.1fs | length=%d | text=%s",
         response.id,
+        route,
+        elapsed,
         len(raw_text),
         raw_text[:500],
     )
 
-    data = _parse_json(raw_text)
-    parsed = GptResponse.model_validate(data)
+    if GPT_RECORD_PATH:
+        _record(GPT_RECORD_PATH, {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "route": route,
+            "model": model,
+            "instructions_sha": hashlib.sha256(system_prompt.encode()).hexdigest()[:12],
+            "user_message": user_message,
+            "previous_response_id": previous_response_id,
+            "response_id": response.id,
+            "output_text": raw_text,
+            "latency": round(elapsed, 3),
+            "input_tokens": usage.input_tokens if usage else None,
+            "output_tokens": usage.output_tokens if usage else None,
+        })
+
+    return raw_text, response.id
+
+
+def _record(path: str, entry: dict) -> None:
+    try:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError:
+        logger.exception("GPT RECORD ERROR | path=%s", path)
+
+
+async def _call_model(
+    route: str,
+    system_prompt: str,
+    user_message: str,
+    previous_response_id: str | None,
+) -> tuple[GptResponse, str]:
+    raw_text, response_id = await _request(
+        route, system_prompt, user_message, previous_response_id,
+    )
+
+    try:
+        data = _parse_json(raw_text)
+        parsed = GptResponse.model_validate(data)
+    except (ValueError, ValidationError):
+        _stats[route].failures += 1
+        raise
 
     logger.info("GPT PARSED | status=%s questions=%d", parsed.status, len(parsed.questions))
 
-    return parsed, response.id
+    return parsed, response_id
+
+
+# ── parallel variant generation ──────────────────────────
+
+_OUTLINE_REQUEST = """
+
+Информации достаточно. Пришли только каркас сметы: status "ready" и result со всеми полями \
+(project_name, client, project_type, scope_summary, assumptions, risks, out_of_scope), \
+а в variants — только name и description каждого варианта, без phases и timeline. \
+Этапы и задачи по вариантам я запрошу отдельно."""
+
+_VARIANT_MESSAGE = """\
+Сформируй детальную смету только для варианта «{name}» ({description}).
+Scope, допущения, риски и роли — как в твоём последнем ответе; остальные варианты не нужны.
+Ответь только JSON-объектом варианта, без "status" и "result":
+{{"name": "{name}", "description": "...", "phases": [...], "timeline": {{...}}}}"""
+
+
+async def _generate_variant(
+    system_prompt: str,
+    outline: Variant,
+    previous_response_id: str,
+) -> Variant:
+    message = _VARIANT_MESSAGE.format(name=outline.name, description=outline.description)
+    for attempt in range(1, PARALLEL_VARIANT_ATTEMPTS + 1):
+        try:
+            raw_text, _ = await _request(
+                ROUTE_ESTIMATE, system_prompt, message, previous_response_id,
+            )
+        except APIError:
+            logger.warning(
+                "GPT VARIANT API ERROR | variant=%s attempt=%d/%d",
+                outline.name, attempt, PARALLEL_VARIANT_ATTEMPTS, exc_info=True,
+            )
+            if attempt < PARALLEL_VARIANT_ATTEMPTS:
+                await asyncio.sleep(attempt)
+            continue
+        try:
+            data = _parse_json(raw_text)
+            if not isinstance(data, dict):
+                raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+            variant = Variant.model_validate(data.get("variant", data))
+        except (ValueError, ValidationError):
+            _stats[ROUTE_ESTIMATE].failures += 1
+            logger.warning(
+                "GPT VARIANT FAILED | variant=%s attempt=%d/%d",
+                outline.name, attempt, PARALLEL_VARIANT_ATTEMPTS, exc_info=True,
+            )
+            continue
+        variant.name = outline.name
+        return variant
+    raise ValueError(f"Variant {outline.name!r} failed after {PARALLEL_VARIANT_ATTEMPTS} attempts")
+
+
+async def generate_variants_parallel(
+    system_prompt: str,
+    outline: EstimateResult,
+    previous_response_id: str,
+) -> EstimateResult:
+    """Generate every variant of *outline* as its own concurrent request.
+
+    All requests continue from *previous_response_id* (the outline
+    response), so they share the dialog, scope and assumptions; each
+    variant is retried on its own. If one still fails, the others are
+    cancelled and the error is raised. The variants are merged back into
+    a copy of *outline*.
+    """
+    tasks = [
+        asyncio.create_task(_generate_variant(system_prompt, v, previous_response_id))
+        for v in outline.variants
+    ]
+    try:
+        variants = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return outline.model_copy(update={"variants": list(variants)})
+
+
+async def _estimate_parallel(
+    system_prompt: str,
+    user_message: str,
+    previous_response_id: str | None,
+) -> tuple[GptResponse, str] | None:
+    """Outline on the estimate model, then one concurrent request per variant.
+
+    Passes the estimate model's questions through if it still needs info.
+    Returns None when the parallel path doesn't apply or fails, so the
+    caller falls back to a single full-estimate call.
+    """
+    started = time.perf_counter()
+    try:
+        outline, outline_id = await _call_model(
+            ROUTE_ESTIMATE, system_prompt, user_message + _OUTLINE_REQUEST, previous_response_id,
+        )
+    except (ValueError, ValidationError, APIError):
+        logger.warning("GPT OUTLINE FAILED", exc_info=True)
+        return None
+    if outline.status == "need_info":
+        # the estimate model disagrees with the light one — let it ask
+        return outline, outline_id
+    if outline.status != "ready" or not outline.result or len(outline.result.variants) < 2:
+        logger.info("GPT OUTLINE | not parallelizable | status=%s", outline.status)
+        return None
+
+    try:
+        result = await generate_variants_parallel(system_prompt, outline.result, outline_id)
+    except (ValueError, APIError):
+        logger.warning("GPT PARALLEL FAILED | falling back to a single call", exc_info=True)
+        return None
+
+    logger.info(
+        "GPT PARALLEL | variants=%d | %.1fs",
+        len(result.variants), time.perf_counter() - started,
+    )
+    return GptResponse(status="ready", result=result, detached=True), outline_id
+
+
+async def ask_gpt(
+    system_prompt: str,
+    user_message: str,
+    previous_response_id: str | None = None,
+    route: str = ROUTE_ESTIMATE,
+) -> tuple[GptResponse, str]:
+    """Send a message to GPT and return parsed response + response_id.
+
+    The model is picked by conversation stage (see GPT_ROUTES). A cheaper
+    route is escalated to the estimate model when its output fails to
+    parse/validate. Question rounds run with READY_SIGNAL_ADDENDUM: the
+    light model only answers {"status": "ready"} once the brief is
+    complete, and the estimate model then writes the estimate.
+
+    With PARALLEL_VARIANTS, the estimate model first returns an outline
+    (scope, assumptions, variant names); each variant is then generated
+    concurrently and the merged result is marked ``detached``.
+
+    Returns:
+        (GptResponse, response_id) tuple
+    """
+    instructions = system_prompt
+    if route == ROUTE_QUESTIONS:
+        instructions += READY_SIGNAL_ADDENDUM
+
+    try:
+        parsed, response_id = await _call_model(
+            route, instructions, user_message, previous_response_id,
+        )
+    except (ValueError, ValidationError):
+        if route == ROUTE_ESTIMATE:
+            raise
+        logger.warning("GPT ESCALATE | route=%s | invalid output", route, exc_info=True)
+    else:
+        if not (route == ROUTE_QUESTIONS and parsed.status == "ready"):
+            return parsed, response_id
+        logger.info("GPT ESCALATE | route=%s | ready signal", route)
+
+        if PARALLEL_VARIANTS:
+            merged = await _estimate_parallel(system_prompt, user_message, previous_response_id)
+            if merged:
+                _stats[route].escalations += 1
+                return merged
+
+    _stats[route].escalations += 1
+    return await _call_model(
+        ROUTE_ESTIMATE, system_prompt, user_message, previous_response_id,
+    )
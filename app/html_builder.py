@@ -1,17 +1,28 @@
 from __future__ import annotations
 
+import asyncio
 import tempfile
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import date
 from pathlib import Path
 
 from jinja2 import Environment, FileSystemLoader
 
+from app.config import RENDER_WORKERS
 from app.models import EstimateResult
 
 _TEMPLATE_DIR = Path(__file__).parent / "templates"
 
+_env = Environment(
+    loader=FileSystemLoader(str(_TEMPLATE_DIR)),
+    autoescape=True,
+)
+
+# rendering (PDF especially) is CPU-bound; keep it off the event loop
+_render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+
 
 @dataclass
 class RoleInfo:
@@ -92,11 +103,7 @@ def render_estimate(result: EstimateResult, rates: dict[str, int]) -> str:
     """Render estimate to a temporary HTML file. Returns the file path."""
     variants, role_summary, totals = _enrich(result, rates)
 
-    env = Environment(
-        loader=FileSystemLoader(str(_TEMPLATE_DIR)),
-        autoescape=True,
-    )
-    template = env.get_template("estimate.html")
+    template = _env.get_template("estimate.html")
 
     html = template.render(
         result=result,
@@ -121,11 +128,7 @@ def render_estimate_pdf(result: EstimateResult, rates: dict[str, int]) -> str:
 
     variants, role_summary, totals = _enrich(result, rates)
 
-    env = Environment(
-        loader=FileSystemLoader(str(_TEMPLATE_DIR)),
-        autoescape=True,
-    )
-    template = env.get_template("estimate_pdf.html")
+    template = _env.get_template("estimate_pdf.html")
 
     html_str = template.render(
         result=result,
@@ -142,3 +145,15 @@ def render_estimate_pdf(result: EstimateResult, rates: dict[str, int]) -> str:
     tmp.close()
     HTML(string=html_str).write_pdf(tmp.name)
     return tmp.name
+
+
+async def render_estimate_async(result: EstimateResult, rates: dict[str, int]) -> str:
+    """render_estimate in the shared render pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_render_pool, render_estimate, result, rates)
+
+
+async def render_estimate_pdf_async(result: EstimateResult, rates: dict[str, int]) -> str:
+    """render_estimate_pdf in the shared render pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_render_pool, render_estimate_pdf, result, rates)
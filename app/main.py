@@ -2,9 +2,11 @@ import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 
+from app.api import require_token, router as api_router
 from app.bot import create_bot
+from app.gpt_client import get_route_stats
 
 # ── logging setup ────────────────────────────────────────
 LOG_DIR = Path(__file__).resolve().parent.parent / "logs"
@@ -37,8 +39,14 @@ async def lifespan(app: FastAPI):
 
 
 app = FastAPI(lifespan=lifespan)
+app.include_router(api_router)
 
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+@app.get("/stats", dependencies=[Depends(require_token)])
+async def stats():
+    return {"routes": get_route_stats()}
@@ -51,6 +51,10 @@ class EstimateResult(BaseModel):
 
 
 class GptResponse(BaseModel):
-    status: str  # "need_info" | "ready"
+    status: str  # "need_info" | "ready" | "patch"
     questions: list[str] = []
     result: EstimateResult | None = None
+    patch: list[dict] = []  # JSON-patch ops against the previous estimate
+    # set locally when `result` was assembled outside the GPT thread,
+    # so the model has not seen it in its conversation history
+    detached: bool = Field(default=False, exclude=True)
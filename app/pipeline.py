@@ -0,0 +1,225 @@
+"""Estimation pipeline shared by the Telegram bot and the HTTP API.
+
+One user message is one turn: build_system_prompt → ask_gpt → patch /
+repair → diff against the previous revision. The session dict (see
+app.sessions) carries the dialog state between turns.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from app.compact import CompactEstimate
+from app.diff import EstimateDiff, apply_patch, diff_estimates
+from app.gpt_client import ROUTE_QUESTIONS, ROUTE_REFINE, ask_gpt
+from app.html_builder import render_estimate_async, render_estimate_pdf_async
+from app.models import EstimateResult
+from app.prompt import build_system_prompt
+from app.validation import Violation, format_violations, repair_estimate
+
+logger = logging.getLogger(__name__)
+
+STAGE_BRIEF, STAGE_DIALOG, STAGE_REFINE = "brief", "dialog", "refine"
+
+
+@dataclass
+class TurnResult:
+    status: str  # "questions" | "estimate" | "unchanged" | "error"
+    questions: list[str] = field(default_factory=list)
+    result: EstimateResult | None = None
+    diff: EstimateDiff | None = None
+    fixes: list[str] = field(default_factory=list)
+    unresolved: list[Violation] = field(default_factory=list)
+    error: str = ""
+
+
+def reset_session(session: dict) -> None:
+    for key in ("stage", "response_id", "estimates", "estimate_detached", "questions"):
+        session.pop(key, None)
+
+
+def current_estimate(session: dict, version: int | None = None) -> EstimateResult | None:
+    """Estimate revision *version* (1-based; latest by default) as a pydantic model."""
+    estimates = session.get("estimates") or []
+    if not estimates:
+        return None
+    if version is None:
+        return estimates[-1].to_model()
+    if not 1 <= version <= len(estimates):
+        return None
+    return estimates[version - 1].to_model()
+
+
+def _with_estimate(session: dict, message: str) -> str:
+    # the current estimate was never part of the GPT thread — show it once
+    if session.get("estimate_detached") and session.get("estimates"):
+        return (
+            "Актуальная версия сметы (result), правки считай относительно неё:\n"
+            + session["estimates"][-1].to_model().model_dump_json()
+            + "\n\nПравки: " + message
+        )
+    return message
+
+
+async def _repair(
+    session: dict,
+    result: EstimateResult,
+    rates: dict[str, int],
+    tag: str,
+) -> tuple[EstimateResult, list[str], list[Violation]]:
+    """Fix rule violations locally; ask GPT once only for what can't be fixed."""
+    repair = repair_estimate(result, rates)
+
+    if repair.unresolved:
+        logger.warning("ESTIMATE UNRESOLVED | %s | violations=%d", tag, len(repair.unresolved))
+        message = format_violations(repair.unresolved)
+        if session.get("estimate_detached"):
+            message = (
+                "Актуальная версия сметы (result):\n"
+                + result.model_dump_json() + "\n\n" + message
+            )
+        try:
+            gpt_resp, response_id = await ask_gpt(
+                system_prompt=build_system_prompt(rates),
+                user_message=message,
+                previous_response_id=session.get("response_id"),
+                route=ROUTE_REFINE,
+            )
+            if gpt_resp.status == "patch":
+                repair = repair_estimate(apply_patch(result, gpt_resp.patch), rates)
+            elif gpt_resp.status == "ready" and gpt_resp.result:
+                repair = repair_estimate(gpt_resp.result, rates)
+            else:
+                raise ValueError(f"unexpected status {gpt_resp.status!r}")
+            # advance the thread only once its answer is applied, so the
+            # model never believes in a fix the session doesn't have
+            session["response_id"] = response_id
+            session["estimate_detached"] = False
+        except Exception:
+            logger.exception("GPT ERROR on repair | %s", tag)
+
+    if repair.fixes:
+        logger.info("ESTIMATE REPAIRED | %s | fixes=%d", tag, len(repair.fixes))
+        # GPT still has the unrepaired version in its thread
+        session["estimate_detached"] = True
+
+    return repair.result, repair.fixes, repair.unresolved
+
+
+async def run_turn(
+    session: dict,
+    text: str,
+    rates: dict[str, int],
+    tag: str = "",
+    progress: Callable[[str], None] | None = None,
+) -> TurnResult:
+    """Send one user message through the pipeline and update *session*.
+
+    GPT errors propagate. On a GPT error or a patch that can't be applied
+    the session is left as it was before the turn.
+    """
+    notify = progress or (lambda step: None)
+    stage = session.get("stage", STAGE_BRIEF)
+    route = ROUTE_REFINE if stage == STAGE_REFINE else ROUTE_QUESTIONS
+    message = _with_estimate(session, text) if stage == STAGE_REFINE else text
+    prev_id = None if stage == STAGE_BRIEF else session.get("response_id")
+
+    notify("gpt")
+    gpt_resp, response_id = await ask_gpt(
+        system_prompt=build_system_prompt(rates),
+        user_message=message,
+        previous_response_id=prev_id,
+        route=route,
+    )
+    last_response_id = session.get("response_id")
+    session["response_id"] = response_id
+    logger.info("TURN OK | %s | stage=%s response_id=%s", tag, stage, response_id)
+
+    if gpt_resp.status == "need_info":
+        logger.info("GPT→QUESTIONS | %s | count=%d", tag, len(gpt_resp.questions))
+        session["stage"] = STAGE_DIALOG
+        session["questions"] = gpt_resp.questions
+        return TurnResult("questions", questions=gpt_resp.questions)
+
+    if gpt_resp.status == "patch":
+        previous = current_estimate(session)
+        if previous is None:
+            logger.warning("GPT→PATCH without estimate | %s", tag)
+            session["stage"] = STAGE_DIALOG
+            return TurnResult("error", error="Нет сметы, к которой можно применить правки.")
+        try:
+            result = apply_patch(previous, gpt_resp.patch)
+        except ValueError:
+            logger.exception("PATCH APPLY ERROR | %s | ops=%d", tag, len(gpt_resp.patch))
+            # fork the GPT thread from before this patch: it must not believe
+            # the patch was applied, or later patch indices would be off
+            if last_response_id is None:
+                session.pop("response_id", None)
+            else:
+                session["response_id"] = last_response_id
+            return TurnResult(
+                "error",
+                error="Не удалось применить правки. Попробуйте сформулировать их иначе.",
+            )
+        logger.info("GPT→PATCH | %s | ops=%d", tag, len(gpt_resp.patch))
+        session["estimate_detached"] = False
+    elif gpt_resp.status == "ready" and gpt_resp.result:
+        result = gpt_resp.result
+        logger.info(
+            "GPT→ESTIMATE | %s | project=%s variants=%d",
+            tag, result.project_name, len(result.variants),
+        )
+        session["estimate_detached"] = gpt_resp.detached
+    else:
+        logger.warning("GPT→UNEXPECTED | %s | status=%s", tag, gpt_resp.status)
+        return TurnResult("error", error="Неожиданный ответ от GPT.")
+
+    notify("repair")
+    result, fixes, unresolved = await _repair(session, result, rates, tag)
+    # an estimate is back: the next message is a refinement, whatever was asked before
+    session["stage"] = STAGE_REFINE
+    session.pop("questions", None)
+
+    estimates = session.setdefault("estimates", [])
+    diff = None
+    if estimates:
+        diff = diff_estimates(estimates[-1].to_model(), result, rates)
+        logger.info(
+            "ESTIMATE DIFF | %s | version=%d tasks_changed=%d",
+            tag, len(estimates) + 1, len(diff.tasks),
+        )
+        if diff.empty:
+            return TurnResult("unchanged", result=result, diff=diff)
+
+    # revisions are kept compact to keep long-lived sessions small
+    estimates.append(CompactEstimate.from_model(result))
+    return TurnResult(
+        "estimate", result=result, diff=diff, fixes=fixes, unresolved=unresolved,
+    )
+
+
+async def render_files(
+    result: EstimateResult,
+    rates: dict[str, int],
+    tag: str = "",
+) -> tuple[str | None, str | None]:
+    """Render HTML and PDF concurrently in the render pool.
+
+    Returns (html_path, pdf_path); a format that failed to render is None.
+    The caller owns (and must delete) the temp files.
+    """
+    html_path, pdf_path = await asyncio.gather(
+        render_estimate_async(result, rates),
+        render_estimate_pdf_async(result, rates),
+        return_exceptions=True,
+    )
+    if isinstance(html_path, BaseException):
+        logger.error("HTML RENDER ERROR | %s", tag, exc_info=html_path)
+        html_path = None
+    if isinstance(pdf_path, BaseException):
+        logger.error("PDF RENDER ERROR | %s", tag, exc_info=pdf_path)
+        pdf_path = None
+    return html_path, pdf_path
@@ -1,5 +1,24 @@
+from functools import lru_cache
+
+# appended for question rounds on the light model: it only decides whether
+# the brief is complete, the estimate itself is written by the heavy model
+READY_SIGNAL_ADDENDUM = """
+
+## Режим уточнения
+
+Сейчас ты только собираешь информацию. Если информации уже достаточно для сметы, НЕ составляй её — ответь ровно так:
+
+{"status": "ready"}
+"""
+
+
 def build_system_prompt(rates: dict[str, int]) -> str:
-    rates_block = "\n".join(f"  {role}: {rate} руб/час" for role, rate in rates.items())
+    return _build_system_prompt(tuple(rates.items()))
+
+
+@lru_cache(maxsize=32)
+def _build_system_prompt(rates: tuple[tuple[str, int], ...]) -> str:
+    rates_block = "\n".join(f"  {role}: {rate} руб/час" for role, rate in rates)
 
     return f"""\
 Ты — опытный IT-оценщик (estimation expert). Твоя задача — помочь пользователю составить детальную смету на IT-проект.
@@ -80,6 +99,25 @@ def build_system_prompt(rates: dict[str, int]) -> str:
 }}
 ```
 
+### Если пользователь просит правки к уже выданной смете:
+
+Не присылай смету целиком — верни только изменения в формате JSON Patch (RFC 6902) относительно последней выданной тобой версии сметы (объект "result"):
+
+```json
+{{
+  "status": "patch",
+  "patch": [
+    {{"op": "replace", "path": "/variants/0/phases/2/tasks/1/hours_base", "value": 24}},
+    {{"op": "add", "path": "/variants/0/phases/2/tasks/-", "value": {{"task": "Новая задача", "role": "Backend", "hours_min": 8, "hours_base": 12, "hours_max": 16}}}},
+    {{"op": "remove", "path": "/variants/1/phases/0/tasks/3"}}
+  ]
+}}
+```
+
+- Допустимые операции: add, remove, replace. Пути — от корня объекта "result", индексы с нуля.
+- Операции применяются по порядку: учитывай сдвиг индексов после add/remove.
+- Если правки затрагивают большую часть сметы, верни её целиком со статусом "ready".
+
 ## Роли и ставки
 
 Используй ТОЛЬКО следующие роли (role) в задачах:
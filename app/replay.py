@@ -0,0 +1,314 @@
+"""Offline record/replay harness for prompt and pipeline regressions.
+
+Record a scripted dialog against the live API (or set GPT_RECORD_PATH to
+capture real bot traffic), then evaluate or replay the corpus without any
+network access:
+
+    python -m app.replay record brief_berezka.txt corpus/berezka.jsonl
+    python -m app.replay eval corpus/berezka.jsonl [--baseline corpus/old.jsonl] [--pdf]
+    python -m app.replay run brief_berezka.txt corpus/berezka.jsonl
+
+``eval`` pushes every recorded response through the current parsing,
+validation and rendering stack; ``run`` re-plays the whole dialog through
+pipeline.run_turn (patching, repair, diff) with a fake client that serves
+the recorded responses.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+from pydantic import ValidationError
+
+from app.config import DEFAULT_RATES
+from app.diff import apply_patch
+from app.models import EstimateResult, GptResponse, Variant
+from app.validation import find_violations, repair_estimate
+
+if TYPE_CHECKING:
+    from app.pipeline import TurnResult
+
+# a scripted answer for question rounds, so recorded dialogs are repeatable
+AUTO_ANSWER = (
+    "Дополнительной информации нет. Прими разумные допущения, "
+    "зафиксируй их в assumptions и сформируй смету."
+)
+MAX_QUESTION_ROUNDS = 3
+
+
+def load_corpus(path: str | Path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _gpt_client():
+    # the OpenAI client refuses to construct without a key; replay never uses it
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+    from app import gpt_client
+    return gpt_client
+
+
+# ── replay client ────────────────────────────────────────
+
+class ReplayClient:
+    """Stands in for AsyncOpenAI: serves recorded responses, never hits the network.
+
+    Responses are looked up by (previous_response_id, user message); repeated
+    keys (e.g. an escalated request) are served in recording order.
+    """
+
+    def __init__(self, records: list[dict]):
+        self._queues: dict[tuple, deque] = defaultdict(deque)
+        for r in records:
+            self._queues[(r["previous_response_id"], r["user_message"])].append(r)
+        self.responses = self
+
+    async def create(self, *, input: list[dict], previous_response_id: str | None = None, **_):
+        key = (previous_response_id, input[0]["content"])
+        queue = self._queues.get(key)
+        if not queue:
+            raise LookupError(
+                f"No recorded response for prev_id={previous_response_id} "
+                f"message={input[0]['content'][:100]!r}"
+            )
+        r = queue.popleft()
+        usage = None
+        if r.get("input_tokens") is not None:
+            usage = SimpleNamespace(input_tokens=r["input_tokens"], output_tokens=r["output_tokens"])
+        return SimpleNamespace(id=r["response_id"], output_text=r["output_text"], usage=usage)
+
+
+async def run_dialog(brief: str, rates: dict[str, int] = DEFAULT_RATES) -> TurnResult:
+    """The bot's brief → questions → estimate flow with scripted answers.
+
+    Goes through pipeline.run_turn, so patches, repair requests and diffs
+    are recorded and replayed exactly as the bot makes them.
+    """
+    _gpt_client()
+    from app.pipeline import run_turn
+
+    session: dict = {}
+    turn = await run_turn(session, brief, rates, tag="replay")
+    rounds = 0
+    while turn.status == "questions" and rounds < MAX_QUESTION_ROUNDS:
+        turn = await run_turn(session, AUTO_ANSWER, rates, tag="replay")
+        rounds += 1
+    return turn
+
+
+# ── offline evaluation ───────────────────────────────────
+
+@dataclass
+class Report:
+    responses: int = 0
+    superseded: int = 0
+    parse_failures: int = 0
+    validation_failures: int = 0
+    patch_failures: int = 0
+    render_failures: int = 0
+    statuses: Counter = field(default_factory=Counter)
+    violations: Counter = field(default_factory=Counter)
+    auto_fixes: int = 0
+    unrepairable: int = 0
+    estimate_hours: list[float] = field(default_factory=list)
+    pipeline_latency: list[float] = field(default_factory=list)
+    gpt_latency: float = 0.0
+
+    @property
+    def parse_success_rate(self) -> float:
+        ok = self.responses - self.parse_failures - self.validation_failures
+        return ok / self.responses if self.responses else 0.0
+
+
+def _total_hours(result: EstimateResult) -> float:
+    return sum(t.hours_base for v in result.variants for p in v.phases for t in p.tasks)
+
+
+def _render(result: EstimateResult, rates: dict[str, int], pdf: bool) -> None:
+    from app.html_builder import render_estimate, render_estimate_pdf
+
+    os.unlink(render_estimate(result, rates))
+    if pdf:
+        os.unlink(render_estimate_pdf(result, rates))
+
+
+def evaluate(
+    records: list[dict],
+    rates: dict[str, int] = DEFAULT_RATES,
+    pdf: bool = False,
+) -> Report:
+    """Run every recorded response through parse → validate → rules → repair → render.
+
+    A response re-requested with the same (previous_response_id, message)
+    — an escalation or a retry — is superseded: only the last one counts.
+    """
+    parse_json = _gpt_client()._parse_json
+    report = Report()
+    # estimate visible at each point of a response chain, for applying patches
+    estimate_at: dict[str, EstimateResult | None] = {}
+    last = {(r["previous_response_id"], r["user_message"]): i for i, r in enumerate(records)}
+
+    for i, r in enumerate(records):
+        if last[(r["previous_response_id"], r["user_message"])] != i:
+            report.superseded += 1
+            continue
+        report.responses += 1
+        report.gpt_latency += r.get("latency") or 0.0
+        prev_estimate = estimate_at.get(r["previous_response_id"])
+        estimate_at[r["response_id"]] = prev_estimate
+        started = time.perf_counter()
+
+        try:
+            data = parse_json(r["output_text"])
+        except ValueError:
+            report.parse_failures += 1
+            continue
+
+        try:
+            if "status" not in data and "phases" in data:
+                # a per-variant response from parallel generation
+                Variant.model_validate(data)
+                report.statuses["variant"] += 1
+                continue
+            resp = GptResponse.model_validate(data)
+        except ValidationError:
+            report.validation_failures += 1
+            continue
+        result = resp.result if resp.status == "ready" else None
+        if result and not any(v.phases for v in result.variants):
+            # the outline that parallel variant generation fans out from
+            report.statuses["outline"] += 1
+            continue
+        report.statuses[resp.status] += 1
+
+        if resp.status == "patch" and prev_estimate is not None:
+            try:
+                result = apply_patch(prev_estimate, resp.patch)
+            except ValueError:
+                report.patch_failures += 1
+        if result is None:
+            continue
+
+        estimate_at[r["response_id"]] = result
+        for v in find_violations(result, rates):
+            report.violations[v.rule] += 1
+        repair = repair_estimate(result, rates)
+        report.auto_fixes += len(repair.fixes)
+        report.unrepairable += len(repair.unresolved)
+        result = repair.result
+        try:
+            _render(result, rates, pdf)
+        except Exception:
+            report.render_failures += 1
+        report.pipeline_latency.append(time.perf_counter() - started)
+        report.estimate_hours.append(_total_hours(result))
+
+    return report
+
+
+def format_report(report: Report, baseline: Report | None = None) -> str:
+    lines = [
+        f"responses:           {report.responses} (+{report.superseded} superseded)",
+        f"parse success rate:  {report.parse_success_rate:.1%}",
+        f"parse failures:      {report.parse_failures}",
+        f"validation failures: {report.validation_failures}",
+        f"patch failures:      {report.patch_failures}",
+        f"render failures:     {report.render_failures}",
+        f"statuses:            {dict(report.statuses)}",
+        f"rule violations:     {dict(report.violations) or 0}",
+        f"auto-fixed / left:   {report.auto_fixes} / {report.unrepairable}",
+        f"estimate hours:      {[round(h) for h in report.estimate_hours]}",
+        f"recorded GPT time:   {report.gpt_latency:.1f}s",
+    ]
+    if report.pipeline_latency:
+        lines.append(
+            f"local pipeline:      median {statistics.median(report.pipeline_latency) * 1000:.1f} ms, "
+            f"max {max(report.pipeline_latency) * 1000:.1f} ms per estimate"
+        )
+    if baseline is not None:
+        # estimates are paired in order, so record both corpora with the same script
+        drifts = [
+            (h - b) / b for h, b in zip(report.estimate_hours, baseline.estimate_hours) if b
+        ]
+        if drifts:
+            lines.append(
+                "total-hours drift:   "
+                + ", ".join(f"{d:+.1%}" for d in drifts)
+                + f" (mean |drift| {statistics.mean(abs(d) for d in drifts):.1%})"
+            )
+        else:
+            lines.append("total-hours drift:   no comparable estimates")
+    return "\n".join(lines)
+
+
+# ── CLI ──────────────────────────────────────────────────
+
+def _record(brief_path: str, corpus_path: str) -> None:
+    gpt_client = _gpt_client()
+    Path(corpus_path).unlink(missing_ok=True)
+    gpt_client.GPT_RECORD_PATH = corpus_path
+    turn = asyncio.run(run_dialog(Path(brief_path).read_text(encoding="utf-8")))
+    print(f"recorded {len(load_corpus(corpus_path))} responses → {corpus_path} (final status: {turn.status})")
+
+
+def _run(brief_path: str, corpus_path: str, pdf: bool) -> None:
+    gpt_client = _gpt_client()
+    gpt_client._client = ReplayClient(load_corpus(corpus_path))
+    # a GPT_RECORD_PATH from .env would append the replayed responses to the live corpus
+    gpt_client.GPT_RECORD_PATH = None
+    brief = Path(brief_path).read_text(encoding="utf-8")
+
+    started = time.perf_counter()
+    turn = asyncio.run(run_dialog(brief))
+    if turn.result:
+        _render(turn.result, DEFAULT_RATES, pdf)
+    elapsed = time.perf_counter() - started
+
+    print(f"final status: {turn.status}")
+    if turn.result:
+        print(f"estimate hours: {round(_total_hours(turn.result))}")
+        print(f"auto-fixed / left: {len(turn.fixes)} / {len(turn.unresolved)}")
+    print(f"end-to-end local pipeline: {elapsed * 1000:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.replay")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("record", help="run a scripted dialog against the live API")
+    p.add_argument("brief")
+    p.add_argument("corpus")
+
+    p = sub.add_parser("eval", help="evaluate a recorded corpus offline")
+    p.add_argument("corpus")
+    p.add_argument("--baseline", help="corpus to compare total hours against")
+    p.add_argument("--pdf", action="store_true", help="also render PDF")
+
+    p = sub.add_parser("run", help="replay the dialog for a brief from a corpus")
+    p.add_argument("brief")
+    p.add_argument("corpus")
+    p.add_argument("--pdf", action="store_true", help="also render PDF")
+
+    args = parser.parse_args()
+    if args.cmd == "record":
+        _record(args.brief, args.corpus)
+    elif args.cmd == "eval":
+        report = evaluate(load_corpus(args.corpus), pdf=args.pdf)
+        baseline = evaluate(load_corpus(args.baseline)) if args.baseline else None
+        print(format_report(report, baseline))
+    else:
+        _run(args.brief, args.corpus, args.pdf)
+
+
+if __name__ == "__main__":
+    main()
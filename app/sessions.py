@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import uuid
+
+from app.config import SESSION_TTL
+
+
+class SessionStore:
+    """In-memory estimate sessions shared by the Telegram bot and the HTTP API.
+
+    A session is a plain dict (stage, response_id, estimates, ...) keyed by
+    "tg:<user_id>" for the bot and "api:<uuid>" for the API. Each session has
+    an asyncio.Lock so turns never interleave; idle sessions expire after
+    SESSION_TTL seconds.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL):
+        self._ttl = ttl
+        self._sessions: dict[str, dict] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._touched: dict[str, float] = {}
+
+    def get(self, key: str) -> dict | None:
+        self._evict()
+        if key in self._sessions:
+            self._touched[key] = time.monotonic()
+        return self._sessions.get(key)
+
+    def get_or_create(self, key: str) -> dict:
+        session = self.get(key)
+        if session is None:
+            session = self._sessions[key] = {}
+            self._locks[key] = asyncio.Lock()
+            self._touched[key] = time.monotonic()
+        return session
+
+    def create(self, prefix: str = "api") -> tuple[str, dict]:
+        key = f"{prefix}:{uuid.uuid4().hex}"
+        return key, self.get_or_create(key)
+
+    def lock(self, key: str) -> asyncio.Lock:
+        self.get_or_create(key)
+        return self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict(self) -> None:
+        deadline = time.monotonic() - self._ttl
+        for key in [k for k, t in self._touched.items() if t < deadline]:
+            if self._locks[key].locked():
+                continue
+            del self._sessions[key], self._locks[key], self._touched[key]
+
+
+store = SessionStore()
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+
+from app.models import EstimateResult
+
+TASK_HOURS_MIN = 2
+TASK_HOURS_MAX = 40
+
+
+@dataclass
+class Violation:
+    rule: str  # "unknown_role" | "hours_order" | "task_range"
+    where: str
+    detail: str
+
+
+def find_violations(result: EstimateResult, rates: dict[str, int]) -> list[Violation]:
+    """Check an estimate against the rules the system prompt sets."""
+    out: list[Violation] = []
+    for variant in result.variants:
+        for phase in variant.phases:
+            for t in phase.tasks:
+                where = f"{variant.name} / {phase.name} / {t.task}"
+                if t.role not in rates:
+                    out.append(Violation("unknown_role", where, t.role))
+                if not t.hours_min <= t.hours_base <= t.hours_max:
+                    out.append(Violation(
+                        "hours_order", where,
+                        f"{t.hours_min:g} / {t.hours_base:g} / {t.hours_max:g}",
+                    ))
+                if not TASK_HOURS_MIN <= t.hours_base <= TASK_HOURS_MAX:
+                    out.append(Violation("task_range", where, f"{t.hours_base:g} ч"))
+    return out
+
+
+# ── auto-repair ──────────────────────────────────────────
+
+# common names GPT uses instead of our roles (keys are normalized, see _norm)
+ROLE_ALIASES = {
+    "ba": "Аналитик", "sa": "Аналитик", "analyst": "Аналитик",
+    "businessanalyst": "Аналитик", "systemanalyst": "Аналитик",
+    "бизнесаналитик": "Аналитик", "системныйаналитик": "Аналитик",
+    "ux": "Дизайнер", "ui": "Дизайнер", "uxui": "Дизайнер", "uiux": "Дизайнер",
+    "designer": "Дизайнер", "uxдизайнер": "Дизайнер", "uiдизайнер": "Дизайнер",
+    "projectmanager": "PM", "менеджерпроекта": "PM", "руководительпроекта": "PM",
+    "lead": "TechLead", "architect": "TechLead", "архитектор": "TechLead", "техлид": "TechLead",
+    "frontenddeveloper": "Frontend", "фронтенд": "Frontend",
+    "backenddeveloper": "Backend", "бэкенд": "Backend", "бекенд": "Backend",
+    "flutter": "Mobile", "ios": "Mobile", "android": "Mobile", "mobiledeveloper": "Mobile",
+    "tester": "QA", "тестировщик": "QA", "qaengineer": "QA",
+    "sre": "DevOps", "девопс": "DevOps",
+    "dataengineer": "DataEngineer", "dataanalyst": "DataAnalyst",
+    "gisspecialist": "GIS", "гис": "GIS",
+    "technicalwriter": "Writer", "техписатель": "Writer", "техническийписатель": "Writer",
+}
+
+
+@dataclass
+class RepairResult:
+    result: EstimateResult
+    fixes: list[str]
+    unresolved: list[Violation]
+
+
+def _norm(role: str) -> str:
+    return "".join(ch for ch in role.lower() if ch.isalnum())
+
+
+def _resolve_role(role: str, rates: dict[str, int]) -> str | None:
+    key = _norm(role)
+    for known in rates:
+        if _norm(known) == key:
+            return known
+    alias = ROLE_ALIASES.get(key)
+    return alias if alias in rates else None
+
+
+def _split_hours(value: float, parts: int) -> list[float]:
+    """Split hours into *parts* rounded chunks that still sum to *value*."""
+    chunk = round(value / parts, 1)
+    return [chunk] * (parts - 1) + [round(value - chunk * (parts - 1), 1)]
+
+
+def repair_estimate(result: EstimateResult, rates: dict[str, int]) -> RepairResult:
+    """Fix rule violations that do not need the model: role aliases,
+    min/base/max ordering and tasks outside TASK_HOURS_MIN..TASK_HOURS_MAX.
+
+    Works on a copy. Whatever cannot be fixed locally (an unknown role with
+    no alias) is returned in ``unresolved``.
+    """
+    result = result.model_copy(deep=True)
+    fixes: list[str] = []
+
+    for variant in result.variants:
+        for phase in variant.phases:
+            tasks = []
+            for t in phase.tasks:
+                where = f"{variant.name} / {phase.name} / {t.task}"
+
+                if t.role not in rates:
+                    role = _resolve_role(t.role, rates)
+                    if role:
+                        fixes.append(f"{where}: роль {t.role} → {role}")
+                        t.role = role
+
+                hours = (t.hours_min, t.hours_base, t.hours_max)
+                if not t.hours_min <= t.hours_base <= t.hours_max:
+                    t.hours_min, t.hours_base, t.hours_max = sorted(hours)
+                    fixes.append(
+                        f"{where}: часы {'/'.join(f'{h:g}' for h in hours)} → "
+                        f"{t.hours_min:g}/{t.hours_base:g}/{t.hours_max:g}"
+                    )
+
+                if t.hours_base < TASK_HOURS_MIN:
+                    fixes.append(f"{where}: {t.hours_base:g} ч → {TASK_HOURS_MIN} ч")
+                    t.hours_base = float(TASK_HOURS_MIN)
+                    t.hours_max = max(t.hours_max, t.hours_base)
+                    t.hours_min = min(max(t.hours_min, 1.0), t.hours_base)
+
+                if t.hours_base > TASK_HOURS_MAX:
+                    n = math.ceil(t.hours_base / TASK_HOURS_MAX)
+                    fixes.append(f"{where}: {t.hours_base:g} ч разбито на части: {n}")
+                    chunks = zip(
+                        _split_hours(t.hours_min, n),
+                        _split_hours(t.hours_base, n),
+                        _split_hours(t.hours_max, n),
+                    )
+                    for i, (hmin, hbase, hmax) in enumerate(chunks, 1):
+                        tasks.append(t.model_copy(update={
+                            "task": f"{t.task} (часть {i}/{n})",
+                            "hours_min": hmin,
+                            "hours_base": hbase,
+                            "hours_max": hmax,
+                        }))
+                    continue
+
+                tasks.append(t)
+            phase.tasks = tasks
+
+    return RepairResult(result, fixes, find_violations(result, rates))
+
+
+def format_violations(violations: list[Violation]) -> str:
+    """Correction request for GPT listing the problems we could not fix."""
+    labels = {
+        "unknown_role": "роль не из списка",
+        "hours_order": "нарушен порядок hours_min ≤ hours_base ≤ hours_max",
+        "task_range": f"объём задачи вне {TASK_HOURS_MIN}–{TASK_HOURS_MAX} ч",
+    }
+    lines = [f"- {v.where}: {labels[v.rule]} ({v.detail})" for v in violations]
+    return (
+        "В смете есть нарушения правил оценки:\n"
+        + "\n".join(lines)
+        + "\n\nИсправь только эти задачи (используй роли строго из списка) "
+        "и верни исправления."
+    )